@@ -1,32 +1,147 @@
-import json
+import asyncio
 import logging
+import os
+import queue
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from graph_app import build_graph, extract_final_text, build_timeline_with_result
+from graph_app import (
+    build_graph,
+    extract_final_text,
+    build_timeline_with_result,
+    message_to_timeline_event,
+)
+
+# Log records go through a queue so the actual stream writes happen on
+# the listener's thread, off the event loop. Verbose per-request dumps
+# are DEBUG-only; production default is INFO (override via LOG_LEVEL).
+#
+# The listener thread is started in the lifespan, not at import: with
+# gunicorn's preload_app the import runs in the arbiter and threads do
+# not survive fork, so an import-time listener would leave every worker
+# with an undrained queue. Records logged before startup just sit in
+# the queue and are flushed once the worker's listener starts.
+_log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter("API LOG | %(message)s"))
+_log_listener = QueueListener(_log_queue, _stream_handler)
 
 logging.basicConfig(
-    level=logging.INFO,
-    format="API LOG | %(message)s",
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[QueueHandler(_log_queue)],
 )
 log = logging.getLogger("api")
 
 graph = None
 cleanup_cb = None
 
+# Response cache: repeat queries skip the whole agent chain (tens of seconds
+# of LLM round-trips). Kept as an LRU in memory and mirrored to disk so a
+# restarted server stays warm.
+CACHE_PATH = Path(os.getenv("RECOMMEND_CACHE_PATH", ".cache/recommend_cache.json"))
+CACHE_MAX_ENTRIES = 1000
+CACHE_TTL_SECONDS = int(os.getenv("RECOMMEND_CACHE_TTL", "3600"))
+CACHE_SAVE_DELAY_SECONDS = float(os.getenv("RECOMMEND_CACHE_SAVE_DELAY", "2"))
+
+_response_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# In-flight dedup: concurrent requests for the same (intent, query) share
+# one graph run instead of each issuing their own set of LLM calls.
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _cache_key(intent_upper: str, query: str) -> str:
+    return f"{intent_upper}|{query.strip().lower()}"
+
+
+def _load_response_cache() -> None:
+    if not CACHE_PATH.exists():
+        return
+    try:
+        entries = orjson.loads(CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError) as e:
+        log.info("Could not load response cache: %s", e)
+        return
+
+    now = time.time()
+    for key, entry in entries.items():
+        if now - entry.get("ts", 0) < CACHE_TTL_SECONDS:
+            _response_cache[key] = entry
+    log.info("Loaded %d cached responses from disk", len(_response_cache))
+
+
+_save_task: Optional[asyncio.Task] = None
+
+
+def _write_cache_file(snapshot: Dict[str, Any]) -> None:
+    # Write to a per-process tmp file and rename so concurrent workers
+    # never leave a half-written cache behind.
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_PATH.with_name(f"{CACHE_PATH.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(orjson.dumps(snapshot))
+    os.replace(tmp, CACHE_PATH)
+
+
+async def _save_response_cache_soon() -> None:
+    # Debounce: a burst of stores collapses into one write after the
+    # delay, and the dump itself runs on a worker thread so the multi-KB
+    # serialization never blocks the event loop.
+    await asyncio.sleep(CACHE_SAVE_DELAY_SECONDS)
+    snapshot = dict(_response_cache)
+    try:
+        await asyncio.to_thread(_write_cache_file, snapshot)
+    except OSError as e:
+        log.info("Could not persist response cache: %s", e)
+
+
+def _schedule_cache_save() -> None:
+    global _save_task
+    if _save_task is not None and not _save_task.done():
+        return
+    _save_task = asyncio.get_running_loop().create_task(_save_response_cache_soon())
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    if time.time() - entry.get("ts", 0) >= CACHE_TTL_SECONDS:
+        _response_cache.pop(key, None)
+        return None
+    _response_cache.move_to_end(key)
+    return entry["payload"]
+
+
+def _cache_put(key: str, payload: Dict[str, Any]) -> None:
+    _response_cache[key] = {"ts": time.time(), "payload": payload}
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+    _schedule_cache_save()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global graph, cleanup_cb
 
+    _log_listener.start()
+
     log.info("Starting graph...")
     graph, cleanup_cb = await build_graph()
     log.info("Graph initialized")
 
+    _load_response_cache()
+
     try:
         yield
     finally:
@@ -34,8 +149,20 @@ async def lifespan(app: FastAPI):
         if cleanup_cb:
             await cleanup_cb()
 
+        # Flush the debounced cache save so entries stored within the
+        # delay window of SIGTERM still survive the restart.
+        if _save_task is not None and not _save_task.done():
+            _save_task.cancel()
+        if _response_cache:
+            try:
+                _write_cache_file(dict(_response_cache))
+            except OSError as e:
+                log.info("Could not persist response cache: %s", e)
+
+        _log_listener.stop()
 
-app = FastAPI(lifespan=lifespan)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -75,6 +202,66 @@ class RecommendResponse(BaseModel):
     timeline: List[TimelineEvent]
 
 
+def _sse(payload: Dict[str, Any], event: Optional[str] = None) -> str:
+    data = orjson.dumps(payload).decode()
+    if event:
+        return f"event: {event}\ndata: {data}\n\n"
+    return f"data: {data}\n\n"
+
+
+@app.post("/recommend/stream")
+async def recommend_stream(req: RecommendRequest):
+    """
+    Same pipeline as /recommend, but pushes each TimelineEvent over SSE
+    as its agent stage completes, so the frontend can render the timeline
+    progressively instead of waiting out the whole chain. A terminating
+    'final' event carries the parsed stocks.
+    """
+    if graph is None:
+        raise HTTPException(status_code=500, detail="Graph not initialized")
+
+    intent_upper = req.intent.strip().upper()
+    if intent_upper not in {"BUY", "SELL"}:
+        raise HTTPException(status_code=400, detail="intent must be 'buy' or 'sell'")
+
+    log.info("Incoming stream request: query='%s', intent='%s'", req.query, req.intent)
+
+    user_content = f"User intent: {intent_upper}. User query: {req.query}"
+    inputs = {"messages": [{"role": "user", "content": user_content}]}
+
+    async def event_stream():
+        yield _sse(
+            {
+                "step": 0,
+                "role": "human",
+                "agent": "user",
+                "content": user_content,
+                "label": "User query",
+            }
+        )
+
+        history = list(inputs["messages"])
+        step = 1
+        try:
+            async for new_messages in graph.astream(inputs):
+                for msg in new_messages:
+                    yield _sse(message_to_timeline_event(msg, step))
+                    step += 1
+                history.extend(new_messages)
+        except Exception as e:
+            # Headers are already sent, so signal the failure in-band;
+            # without a terminal event the frontend cannot tell a
+            # truncated stream from a complete one.
+            log.info("Stream failed mid-run: %s", e)
+            yield _sse({"detail": "agent pipeline failed"}, event="error")
+            return
+
+        data = extract_final_text({"messages": history})
+        yield _sse(data, event="final")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.post("/recommend", response_model=RecommendResponse)
 async def recommend(req: RecommendRequest):
     if graph is None:
@@ -84,7 +271,35 @@ async def recommend(req: RecommendRequest):
     if intent_upper not in {"BUY", "SELL"}:
         raise HTTPException(status_code=400, detail="intent must be 'buy' or 'sell'")
 
-    log.info(f"Incoming request: query='{req.query}', intent='{req.intent}'")
+    log.info("Incoming request: query='%s', intent='%s'", req.query, req.intent)
+
+    cache_key = _cache_key(intent_upper, req.query)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        log.info("Cache hit, skipping graph run")
+        return RecommendResponse(**cached)
+
+    running = _inflight.get(cache_key)
+    if running is not None:
+        log.info("Joining in-flight run for identical query")
+        try:
+            return RecommendResponse(**await asyncio.shield(running))
+        except asyncio.CancelledError:
+            # If the shared future itself was cancelled, the owner's
+            # client disconnected mid-run; this joiner's request is still
+            # live, so promote it to owner and run the graph below
+            # instead of inheriting the cancellation. Otherwise the
+            # cancellation is our own and must propagate.
+            if not running.cancelled():
+                raise
+            log.info("In-flight owner was cancelled, promoting joiner to owner")
+
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    # Mark any stored exception as retrieved up front: a solo failed run
+    # has no joiners, and an unretrieved exception would spam "Future
+    # exception was never retrieved" at GC.
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[cache_key] = future
 
     inputs = {
         "messages": [
@@ -97,35 +312,50 @@ async def recommend(req: RecommendRequest):
 
     log.info("Running graph...")
 
-    graph_output = await graph.ainvoke(
-        inputs,
-        config={"recursion_limit": 6},
-    )
-
     try:
-        pretty = json.dumps(graph_output, indent=2)
-        log.info(f"Raw graph output:\n{pretty}")
-    except Exception:
-        log.info("Graph output (non-JSON):")
-        log.info(str(graph_output))
-
-    bundle = build_timeline_with_result(graph_output)
-    data = bundle.get("final", {}) or {}
-    timeline_raw = bundle.get("timeline", []) or []
-
-    log.info(f"Parsed structured data: {data}")
-    log.info(f"Timeline events count: {len(timeline_raw)}")
-
-    if "stocks" not in data or not isinstance(data["stocks"], list):
-        log.info("No valid stocks found in model output. Returning empty list.")
-        data = {"stocks": []}
-
-    try:
-        timeline: List[TimelineEvent] = [TimelineEvent(**evt) for evt in timeline_raw]
+        graph_output = await graph.ainvoke(inputs)
+
+        if log.isEnabledFor(logging.DEBUG):
+            try:
+                log.debug("Raw graph output: %s", orjson.dumps(graph_output, default=str).decode())
+            except Exception:
+                log.debug("Graph output (non-JSON): %s", graph_output)
+
+        bundle = build_timeline_with_result(graph_output)
+        data = bundle.get("final", {}) or {}
+        timeline_raw = bundle.get("timeline", []) or []
+
+        log.debug("Parsed structured data: %s", data)
+        log.debug("Timeline events count: %d", len(timeline_raw))
+
+        if "stocks" not in data or not isinstance(data["stocks"], list):
+            log.info("No valid stocks found in model output. Returning empty list.")
+            data = {"stocks": []}
+
+        try:
+            timeline: List[TimelineEvent] = [TimelineEvent(**evt) for evt in timeline_raw]
+        except Exception as e:
+            log.info("Failed to parse timeline events: %s", e)
+            timeline = []
+
+        response = RecommendResponse(stocks=data["stocks"], timeline=timeline)
+        payload = response.model_dump()
+        if data["stocks"]:
+            _cache_put(cache_key, payload)
+        if not future.done():
+            future.set_result(payload)
     except Exception as e:
-        log.info(f"Failed to parse timeline events: {e}")
-        timeline = []
+        if not future.done():
+            future.set_exception(e)
+        raise
+    finally:
+        # Owner cancelled (client disconnect) is a BaseException, so the
+        # except above never resolves the future; cancel it here so
+        # joiners parked on the shield do not hang forever.
+        if not future.done():
+            future.cancel()
+        _inflight.pop(cache_key, None)
 
     log.info("Sending response to frontend")
 
-    return RecommendResponse(stocks=data["stocks"], timeline=timeline)
+    return response
@@ -1,16 +1,349 @@
-import os
+import asyncio
 import json
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
 from typing import Any, Dict, List
 
+import httpx
+import orjson
 from dotenv import load_dotenv
 from langgraph.prebuilt import create_react_agent
-from langgraph_supervisor import create_supervisor
-from langchain_core.messages import convert_to_messages
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    ToolMessage,
+    convert_to_messages,
+)
+from langchain_core.tools import StructuredTool
 from langchain_groq import ChatGroq
 from langchain_mcp_tools import convert_mcp_to_langchain_tools
+from pydantic import BaseModel
 
 load_dotenv()
 
+# Tool-schema cache: skips the MCP SSE handshake (seconds per cold
+# worker) when the schemas were discovered recently. Delete the file or
+# set MCP_TOOLS_REFRESH=1 to force rediscovery.
+MCP_TOOLS_CACHE_PATH = Path(os.getenv("MCP_TOOLS_CACHE_PATH", ".cache/mcp_tools.json"))
+MCP_TOOLS_CACHE_TTL = int(os.getenv("MCP_TOOLS_CACHE_TTL", str(24 * 3600)))
+
+
+def _read_tool_specs_cache():
+    if os.getenv("MCP_TOOLS_REFRESH"):
+        return None
+    if not MCP_TOOLS_CACHE_PATH.exists():
+        return None
+    try:
+        cached = orjson.loads(MCP_TOOLS_CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if time.time() - cached.get("ts", 0) >= MCP_TOOLS_CACHE_TTL:
+        return None
+    return cached.get("tools")
+
+
+def _write_tool_specs_cache(tools) -> None:
+    specs = []
+    for tool in tools:
+        schema = tool.args_schema
+        if schema is not None and not isinstance(schema, dict):
+            schema = schema.model_json_schema()
+        specs.append(
+            {
+                "name": tool.name,
+                "description": tool.description or "",
+                "args_schema": schema,
+            }
+        )
+    try:
+        MCP_TOOLS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        MCP_TOOLS_CACHE_PATH.write_bytes(orjson.dumps({"ts": time.time(), "tools": specs}))
+    except OSError:
+        pass
+
+
+async def _cached_mcp_tools(mcp_servers, allowed_tool_names):
+    """
+    Load the allowed MCP tools, using the on-disk schema cache when it is
+    fresh.
+
+    On a warm start the tools are thin StructuredTool shims rebuilt from
+    cached name/description/args_schema; the actual MCP connection is
+    deferred until the first real tool call, so startup does no network
+    round-trip at all.
+
+    The filter is applied before any wrapper is built, so disallowed
+    tools never get materialized. The upstream loader has no filter
+    kwarg, so on a cold start the full list is still discovered and the
+    unused entries dropped immediately after (the full schema set is
+    cached regardless, so a later change to the allow-list stays warm).
+    """
+    specs = _read_tool_specs_cache()
+
+    if specs is None:
+        tools, cleanup = await convert_mcp_to_langchain_tools(mcp_servers)
+        _write_tool_specs_cache(tools)
+        return [t for t in tools if t.name in allowed_tool_names], cleanup
+
+    specs = [spec for spec in specs if spec["name"] in allowed_tool_names]
+
+    live: Dict[str, Any] = {"tools": None, "cleanup": None}
+    lock = asyncio.Lock()
+
+    async def _connect():
+        async with lock:
+            if live["tools"] is None:
+                tools, cleanup = await convert_mcp_to_langchain_tools(mcp_servers)
+                live["tools"] = {t.name: t for t in tools}
+                live["cleanup"] = cleanup
+        return live["tools"]
+
+    def _make_lazy(spec):
+        async def _call(**kwargs):
+            tools = await _connect()
+            return await tools[spec["name"]].ainvoke(kwargs)
+
+        return StructuredTool(
+            name=spec["name"],
+            description=spec["description"],
+            args_schema=spec["args_schema"] or {},
+            coroutine=_call,
+        )
+
+    lazy_tools = [_make_lazy(spec) for spec in specs]
+
+    async def cleanup():
+        if live["cleanup"] is not None:
+            await live["cleanup"]()
+
+    return lazy_tools, cleanup
+
+
+@lru_cache(maxsize=1)
+def _http_client() -> httpx.AsyncClient:
+    """
+    One pooled HTTP client for all Groq calls: keep-alive connections
+    skip the TCP/TLS handshake (~40-100 ms) on every agent hop, and
+    HTTP/2 multiplexes concurrent batched calls over one connection.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "100")),
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "200")),
+        ),
+        http2=True,
+    )
+
+
+@lru_cache(maxsize=8)
+def _model(max_tokens: int = 450) -> ChatGroq:
+    """
+    Memoized ChatGroq instances, one per generation budget, all sharing
+    the pooled HTTP client. Groq latency and billing scale roughly
+    linearly with generated tokens, so each agent stage gets a budget
+    sized to its typical output instead of a blanket 450.
+    """
+    return ChatGroq(
+        model=os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
+        temperature=0.15,
+        max_tokens=max_tokens,
+        http_async_client=_http_client(),
+    )
+
+
+class StockOut(BaseModel):
+    name: str
+    ticker: str
+    action: str
+    targetPrice: str
+    currentPrice: str
+    trend: str
+    sentiment: str
+    reason: str
+
+
+class StocksOut(BaseModel):
+    stocks: List[StockOut]
+
+
+class DirectStage:
+    """
+    Tool-less agent stage backed by a single LLM call.
+
+    create_react_agent with tools=[] still runs a ReAct scratchpad loop,
+    spending prompt tokens and an extra round-trip on deciding that no
+    tool is needed. A plain chat call (with structured output when a
+    schema is given) does the same job in one hop.
+    """
+
+    def __init__(self, name: str, model, prompt: str, schema=None):
+        self.name = name
+        self.prompt = prompt
+        self.schema = schema
+        self.model = model.with_structured_output(schema) if schema else model
+
+    async def _run_one(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = [{"role": "system", "content": self.prompt}] + list(inputs["messages"])
+
+        if self.schema is not None:
+            # A missing or malformed tool call yields None or raises;
+            # emit empty content so the API's "no valid stocks" fallback
+            # applies instead of failing the whole batch with a 500.
+            try:
+                result = await self.model.ainvoke(messages)
+            except OutputParserException:
+                result = None
+            content = orjson.dumps(result.model_dump()).decode() if result is not None else ""
+        else:
+            result = await self.model.ainvoke(messages)
+            content = result.content if isinstance(result.content, str) else str(result.content)
+
+        reply = AIMessage(content=content, name=self.name)
+        return {"messages": list(inputs["messages"]) + [reply]}
+
+    async def abatch(
+        self, batch: List[Dict[str, Any]], *, return_exceptions: bool = False
+    ) -> List[Any]:
+        return await asyncio.gather(
+            *(self._run_one(inputs) for inputs in batch),
+            return_exceptions=return_exceptions,
+        )
+
+
+class StageBatcher:
+    """
+    Coalesces concurrent calls to one agent stage into a single batched
+    LLM invocation.
+
+    Requests put (inputs, future) on a queue; a background task drains up
+    to max_batch_size items within a max_wait_ms window and issues one
+    abatch call, then fans the results back to the waiting futures.
+    """
+
+    def __init__(self, agent, max_batch_size: int = 8, max_wait_ms: int = 150):
+        self.agent = agent
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._drain_task = None
+
+    def start(self):
+        self._drain_task = asyncio.create_task(self._drain_loop())
+
+    async def stop(self):
+        if self._drain_task:
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+            self._drain_task = None
+
+    async def submit(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((inputs, future))
+        return await future
+
+    async def _drain_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # return_exceptions keeps one bad request from failing the
+            # unrelated users batched into the same window: each future
+            # gets its own result or its own error.
+            try:
+                results = await self.agent.abatch(
+                    [inputs for inputs, _ in batch], return_exceptions=True
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class AgentPipeline:
+    """
+    Drop-in replacement for the supervisor graph.
+
+    Fixed-depth DAG: finder -> (market data || news) -> recommender.
+    Market data and news both depend only on the finder's picks, so they
+    run concurrently; each stage still funnels through its StageBatcher
+    so concurrent requests share batched LLM calls.
+    """
+
+    def __init__(
+        self,
+        finder: StageBatcher,
+        market_data: StageBatcher,
+        news: StageBatcher,
+        recommender: StageBatcher,
+    ):
+        self.finder = finder
+        self.market_data = market_data
+        self.news = news
+        self.recommender = recommender
+        self.stages = [finder, market_data, news, recommender]
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    async def stop(self):
+        for stage in self.stages:
+            await stage.stop()
+
+    async def astream(self, inputs: Dict[str, Any]):
+        """
+        Run the pipeline, yielding the list of new messages each stage
+        produced as soon as that stage completes. The caller accumulates
+        them onto the input history.
+        """
+        initial = list(inputs["messages"])
+        state = await self.finder.submit({"messages": initial})
+        base = state["messages"]
+        yield base[len(initial):]
+
+        # Two ~2-second LLM calls overlap instead of running back to back.
+        data_state, news_state = await asyncio.gather(
+            self.market_data.submit({"messages": base}),
+            self.news.submit({"messages": base}),
+        )
+
+        new = data_state["messages"][len(base):] + news_state["messages"][len(base):]
+        merged = base + new
+        yield new
+
+        state = await self.recommender.submit({"messages": merged})
+        yield state["messages"][len(merged):]
+
+    async def ainvoke(self, inputs: Dict[str, Any], config=None) -> Dict[str, Any]:
+        messages = list(inputs["messages"])
+        async for new_messages in self.astream(inputs):
+            messages.extend(new_messages)
+        return {"messages": messages}
+
 
 async def build_graph():
     api_token = os.getenv("BRIGHT_DATA_API_KEY")
@@ -24,23 +357,14 @@ async def build_graph():
         }
     }
 
-    # This is the part that used to work for you
-    tools, cleanup = await convert_mcp_to_langchain_tools(mcp_servers)
+    # Only the tools we actually hand to agents get materialized
+    data_tools, cleanup = await _cached_mcp_tools(mcp_servers, {"search_engine"})
 
-    # Optional filter if you only want specific tools
-    allowed_tool_names = {"search_engine"}
-    data_tools = [t for t in tools if t.name in allowed_tool_names]
-
-    groq_model = ChatGroq(
-        model=os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
-        temperature=0.15,
-        max_tokens=450,
-    )
-
-    # Agent 1: pick 2 liquid US stocks
-    stock_finder_agent = create_react_agent(
-        groq_model,
-        tools=[],
+    # Agent 1: pick 2 liquid US stocks (no tools, so a single LLM call).
+    # Its whole output is two short lines, so 80 tokens is plenty.
+    stock_finder_agent = DirectStage(
+        "stock_finder_agent",
+        _model(max_tokens=80),
         prompt=(
             "You are a stock picker focused on liquid US equities on NASDAQ and NYSE.\n"
             "Input is user free text that may include an explicit intent line:\n"
@@ -58,12 +382,11 @@ async def build_graph():
             "1) NAME (TICKER) - one short reason\n"
             "2) NAME (TICKER) - one short reason\n"
         ),
-        name="stock_finder_agent",
     )
 
     # Agent 2: fetch market data using MCP tools
     market_data_agent = create_react_agent(
-        groq_model,
+        _model(max_tokens=250),
         tools=data_tools,
         prompt=(
             "You enrich information with recent US market data for the 2 tickers.\n"
@@ -81,7 +404,7 @@ async def build_graph():
 
     # Agent 3: sentiment and news summary
     news_analyst_agent = create_react_agent(
-        groq_model,
+        _model(max_tokens=200),
         tools=data_tools,
         prompt=(
             "You analyze very recent news for each ticker.\n"
@@ -96,13 +419,14 @@ async def build_graph():
         name="news_analyst_agent",
     )
 
-    # Agent 4: final structured JSON recommendation
-    price_recommender_agent = create_react_agent(
-        groq_model,
-        tools=[],
+    # Agent 4: final recommendation, one structured-output call instead of
+    # a ReAct loop that had no tools to call anyway
+    price_recommender_agent = DirectStage(
+        "price_recommender_agent",
+        _model(max_tokens=450),
         prompt=(
             "You receive the full conversation history from other agents.\n"
-            "Your task is to produce final structured output for exactly 2 US stocks.\n"
+            "Your task is to produce the final recommendation for exactly 2 US stocks.\n"
             "\n"
             "User intent rules:\n"
             "- If the initial user message contains \"User intent: BUY\" then both stocks must have action \"BUY\".\n"
@@ -111,82 +435,92 @@ async def build_graph():
             "\n"
             "For each stock, use the best information from the previous agents.\n"
             "Populate fields even if some numbers are approximate.\n"
-            "\n"
-            "Output format:\n"
-            "{\n"
-            "  \"stocks\": [\n"
-            "    {\n"
-            "      \"name\": \"Full company name\",\n"
-            "      \"ticker\": \"TICKER\",\n"
-            "      \"action\": \"BUY\" or \"SELL\" or \"HOLD\",\n"
-            "      \"targetPrice\": \"$123.45\",\n"
-            "      \"currentPrice\": \"$120.00\",\n"
-            "      \"trend\": \"Upward\" or \"Downward\" or \"Sideways\",\n"
-            "      \"sentiment\": \"Positive\" or \"Negative\" or \"Neutral\",\n"
-            "      \"reason\": \"One or two short sentences explaining the recommendation\"\n"
-            "    },\n"
-            "    {\n"
-            "      \"name\": \"...\",\n"
-            "      \"ticker\": \"...\",\n"
-            "      \"action\": \"...\",\n"
-            "      \"targetPrice\": \"$...\",\n"
-            "      \"currentPrice\": \"$...\",\n"
-            "      \"trend\": \"...\",\n"
-            "      \"sentiment\": \"...\",\n"
-            "      \"reason\": \"...\"\n"
-            "    }\n"
-            "  ]\n"
-            "}\n"
-            "\n"
-            "Return only the JSON. Do not include explanations outside the JSON.\n"
+            "Prices are strings like \"$123.45\".\n"
+            "Trend is one of Upward, Downward, Sideways.\n"
+            "Sentiment is one of Positive, Negative, Neutral.\n"
+            "The reason is one or two short sentences explaining the recommendation.\n"
         ),
-        name="price_recommender_agent",
+        schema=StocksOut,
     )
 
-    supervisor_graph = create_supervisor(
-        model=groq_model,
-        agents=[
-            stock_finder_agent,
-            market_data_agent,
-            news_analyst_agent,
-            price_recommender_agent,
-        ],
-        prompt=(
-            "You orchestrate 4 agents to answer the user.\n"
-            "Call them in this strict order when appropriate:\n"
-            "1) stock_finder_agent\n"
-            "2) market_data_agent\n"
-            "3) news_analyst_agent\n"
-            "4) price_recommender_agent\n"
-            "\n"
-            "Stop after price_recommender_agent returns the final JSON.\n"
-            "Do not call agents unnecessarily.\n"
-        ),
-        add_handoff_back_messages=True,
-        output_mode="full_history",
-    ).compile()
+    max_batch_size = int(os.getenv("BATCH_MAX_SIZE", "8"))
+    max_wait_ms = int(os.getenv("BATCH_WAIT_MS", "150"))
+
+    pipeline = AgentPipeline(
+        finder=StageBatcher(stock_finder_agent, max_batch_size, max_wait_ms),
+        market_data=StageBatcher(market_data_agent, max_batch_size, max_wait_ms),
+        news=StageBatcher(news_analyst_agent, max_batch_size, max_wait_ms),
+        recommender=StageBatcher(price_recommender_agent, max_batch_size, max_wait_ms),
+    )
+    pipeline.start()
+
+    mcp_cleanup = cleanup
 
     # cleanup is async and will be awaited by FastAPI lifespan
-    return supervisor_graph, cleanup
+    async def cleanup():
+        await pipeline.stop()
+        await mcp_cleanup()
+        await _http_client().aclose()
+        # A rebuilt graph must not reuse the closed client.
+        _model.cache_clear()
+        _http_client.cache_clear()
+
+    return pipeline, cleanup
 
 
 def get_history_from_output(graph_output: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Extract the messages list from the graph output in a consistent way.
     """
-    if "supervisor" in graph_output and isinstance(graph_output["supervisor"], dict):
-        return graph_output["supervisor"].get("messages", [])
     return graph_output.get("messages", [])
 
 
+# stdlib decoder kept around for its raw_decode, which can parse an
+# object out of the middle of non-JSON text; orjson has no equivalent.
+_DECODER = json.JSONDecoder()
+
+
+def _salvage_stocks(text: str) -> Dict[str, Any]:
+    """
+    Best-effort recovery when the final message is not valid JSON, e.g.
+    truncated by the generation budget or wrapped in prose/code fences.
+    Walks the text and pulls out every complete object found: a full
+    {"stocks": [...]} wrapper wins outright, otherwise any flat objects
+    carrying a "ticker" key are collected.
+    """
+    stocks: List[Dict[str, Any]] = []
+    pos = text.find("{")
+    while pos != -1:
+        try:
+            obj, end = _DECODER.raw_decode(text, pos)
+        except ValueError:
+            pos = text.find("{", pos + 1)
+            continue
+        if isinstance(obj, dict):
+            if "stocks" in obj:
+                return obj
+            if "ticker" in obj:
+                stocks.append(obj)
+        pos = text.find("{", end)
+    return {"stocks": stocks}
+
+
 def extract_final_text(graph_output: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Extract the final JSON object from the last message of the supervisor history.
-    If parsing fails or the format is unexpected, return an empty structure.
+    Extract the final JSON object from the last message of the history.
+    If strict parsing fails, salvage whatever complete stock objects the
+    text contains instead of dropping the whole answer.
     """
     history = get_history_from_output(graph_output)
-    messages = convert_to_messages(history)
+    return _extract_final_from_messages(convert_to_messages(history))
+
 
+def _extract_final_from_messages(messages: List[Any]) -> Dict[str, Any]:
+    """
+    Same as extract_final_text but takes an already-converted message
+    list, so callers that converted the history themselves do not pay
+    for a second conversion.
+    """
     if not messages:
         return {"stocks": []}
 
@@ -200,15 +534,53 @@ def extract_final_text(graph_output: Dict[str, Any]) -> Dict[str, Any]:
         text = str(text)
 
     try:
-        data = json.loads(text)
+        data = orjson.loads(text)
         if isinstance(data, dict) and "stocks" in data:
             return data
-    except json.JSONDecodeError:
-        pass
+    except orjson.JSONDecodeError:
+        return _salvage_stocks(text)
 
     return {"stocks": []}
 
 
+_LABELS = {
+    "stock_finder_agent": "Stock selection",
+    "market_data_agent": "Market data fetch",
+    "news_analyst_agent": "News and sentiment",
+    "price_recommender_agent": "Final JSON",
+}
+
+
+def message_to_timeline_event(msg: Any, step: int) -> Dict[str, Any]:
+    """
+    Convert one message into the timeline event dict consumed by the API.
+    """
+    if isinstance(msg, HumanMessage):
+        role = "human"
+    elif isinstance(msg, ToolMessage):
+        role = "tool"
+    else:
+        role = "ai"
+    agent = msg.name or ("user" if role == "human" else "unknown")
+
+    content = msg.content
+    if not isinstance(content, str):
+        content = str(content)
+
+    if step == 0 and role == "human":
+        label = "User query"
+    else:
+        label = _LABELS.get(agent, "Message")
+
+    return {
+        "step": step,
+        "role": role,
+        "agent": agent,
+        "content": content,
+        "label": label,
+    }
+
+
 def build_timeline_with_result(graph_output: Dict[str, Any]) -> Dict[str, Any]:
     """
     Build a simple timeline array plus the final result dict.
@@ -217,45 +589,9 @@ def build_timeline_with_result(graph_output: Dict[str, Any]) -> Dict[str, Any]:
     history = get_history_from_output(graph_output)
     messages = convert_to_messages(history)
 
-    timeline: List[Dict[str, Any]] = []
-
-    for idx, msg in enumerate(messages):
-        role = getattr(msg, "role", getattr(msg, "type", "")) or "ai"
-        agent = getattr(msg, "name", None)
-        if not agent:
-            if role == "human":
-                agent = "user"
-            else:
-                agent = "unknown"
-
-        content = msg.content
-        if not isinstance(content, str):
-            content = str(content)
-
-        if role == "human" and idx == 0:
-            label = "User query"
-        elif agent == "stock_finder_agent":
-            label = "Stock selection"
-        elif agent == "market_data_agent":
-            label = "Market data fetch"
-        elif agent == "news_analyst_agent":
-            label = "News and sentiment"
-        elif agent == "price_recommender_agent":
-            label = "Final JSON"
-        else:
-            label = "Message"
-
-        timeline.append(
-            {
-                "step": idx,
-                "role": role,
-                "agent": agent,
-                "content": content,
-                "label": label,
-            }
-        )
+    timeline = [message_to_timeline_event(msg, idx) for idx, msg in enumerate(messages)]
 
-    final_result = extract_final_text(graph_output)
+    final_result = _extract_final_from_messages(messages)
 
     return {
         "timeline": timeline,
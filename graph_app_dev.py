@@ -3,7 +3,7 @@ import json
 from dotenv import load_dotenv
 
 from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import convert_to_messages
+from langchain_core.messages import HumanMessage, convert_to_messages
 from langchain_groq import ChatGroq
 
 load_dotenv()
@@ -69,7 +69,10 @@ async def build_graph():
 
 
 def extract_final_text(graph_output: dict) -> dict:
-    messages = convert_to_messages(graph_output["messages"])
+    return _extract_final_from_messages(convert_to_messages(graph_output["messages"]))
+
+
+def _extract_final_from_messages(messages: list) -> dict:
     last = messages[-1]
 
     if hasattr(last, "content"):
@@ -92,10 +95,8 @@ def build_timeline_with_result(graph_output: dict) -> dict:
     timeline = []
 
     for idx, msg in enumerate(messages):
-        role = getattr(msg, "role", getattr(msg, "type", "")) or "ai"
-        agent = getattr(msg, "name", None)
-        if not agent:
-            agent = "user" if role == "human" else "stock_reco_agent"
+        role = "human" if isinstance(msg, HumanMessage) else "ai"
+        agent = msg.name or ("user" if role == "human" else "stock_reco_agent")
 
         content = msg.content if isinstance(msg.content, str) else str(msg.content)
 
@@ -114,7 +115,7 @@ def build_timeline_with_result(graph_output: dict) -> dict:
             }
         )
 
-    final_result = extract_final_text(graph_output)
+    final_result = _extract_final_from_messages(messages)
 
     return {
         "timeline": timeline,
@@ -0,0 +1,22 @@
+import os
+
+# Production server config: run with `gunicorn -c gunicorn_conf.py api:app`.
+#
+# The endpoint is pure I/O awaiting Groq, so workers scale throughput
+# nearly linearly until Groq rate-limits. UvicornWorker picks uvloop and
+# httptools automatically when they are installed.
+#
+# Each worker runs the FastAPI lifespan, so build_graph() and its cleanup
+# execute per worker on startup and SIGTERM.
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", max(2, os.cpu_count() or 2)))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the arbiter so workers inherit the module state
+# (imports, pydantic models, env parsing) via copy-on-write instead of
+# re-importing per fork. File-descriptor-bound resources -- the pooled
+# HTTP client and the MCP connection -- cannot survive a fork, so the
+# graph itself is still built per worker by the FastAPI lifespan; warm
+# workers skip the MCP handshake via the shared on-disk schema cache.
+preload_app = True
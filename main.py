@@ -1,6 +1,10 @@
 import asyncio
-import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
 
+import orjson
 from dotenv import load_dotenv
 from graph_app_dev import (
     build_graph,
@@ -10,6 +14,17 @@ from graph_app_dev import (
 
 load_dotenv()
 
+# Output goes through a queue so the multi-KB dumps are written on the
+# listener's thread, keeping the event loop free for the cleanup step.
+_log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+log = logging.getLogger("main")
+
 
 async def run_agent(user_query: str):
     app, cleanup = await build_graph()
@@ -26,25 +41,31 @@ async def run_agent(user_query: str):
 
         # Run the graph
         final_state = await app.ainvoke(inputs)
-        print("\nRAW graph_output['messages']:\n")
+        log.info("\nRAW graph_output['messages']:\n")
         try:
-            print(json.dumps(final_state["messages"], indent=2))
+            log.info(
+                "%s",
+                orjson.dumps(
+                    final_state["messages"], option=orjson.OPT_INDENT_2, default=str
+                ).decode(),
+            )
         except Exception:
-            print(final_state["messages"])
-      
+            log.info("%s", final_state["messages"])
+
         answer = extract_final_text(final_state)
 
-        print("\nFinal answer:\n")
-        print(json.dumps(answer, indent=2))
+        log.info("\nFinal answer:\n")
+        log.info("%s", orjson.dumps(answer, option=orjson.OPT_INDENT_2).decode())
 
-        # Build timeline 
+        # Build timeline
         timeline_bundle = build_timeline_with_result(final_state)
 
-        print("\nTimeline object:\n")
-        print(json.dumps(timeline_bundle, indent=2))
+        log.info("\nTimeline object:\n")
+        log.info("%s", orjson.dumps(timeline_bundle, option=orjson.OPT_INDENT_2).decode())
 
     finally:
         await cleanup()
+        _log_listener.stop()
 
 
 if __name__ == "__main__":